@@ -1,10 +1,12 @@
 import pandas as pd
+import numpy
 import logging
 import tqdm
 from typing import Optional, Union
 
 from .database import ChromaDB
 from .config import AnnotationConfig, PathConfig
+from .selection import mmr_select, label_balanced_select
 
 class AnnotationProject:
     """
@@ -40,9 +42,10 @@ class AnnotationProject:
         self.reasoning_available: bool = False
 
         
-    def add_data_from_csv(self, path: str, column_mapping: dict = {}, default_split: str = "train") -> None:
+    def add_data_from_csv(self, path: str, column_mapping: dict = {}, default_split: str = "train") -> dict:
         """"
         Reads a CSV file and adds its data to the database.
+        Re-importing or appending a CSV only embeds new or changed rows; unchanged rows are skipped.
 
         Args:
             path: The file path to the CSV file to be read.
@@ -50,6 +53,9 @@ class AnnotationProject:
                             Change value the according column name.
             default_split: The default split value for the records. Default is "train".
             split: If the split is not given as a column in the CSV, this value will be used for the records. 
+
+        Returns:
+            dict: A report with the number of "added", "updated", "skipped" (unchanged), "conflicts" and "migrated" records. See ChromaDB.insert_data.
         """
        
         # handle column mapping
@@ -81,10 +87,11 @@ class AnnotationProject:
 
             records.append(record)
    
-        self.db.insert_data(records=records)        
-        logging.info("Successfully added data.")
+        report: dict = self.db.insert_data(records=records)        
+        logging.info(f"Successfully added data: {report['added']} added, {report['updated']} updated, {report['skipped']} skipped, {report['conflicts']} conflicts, {report['migrated']} migrated.")
         
         self.reasoning_available = True if reasoning_available else False
+        return report
         
 
 
@@ -159,6 +166,17 @@ class AnnotationProject:
         Kwargs: 
             use_reasoning (bool): Whether to include reasoning generation. Defaults to False.
             number_demonstrations (int): The number of demonstrations to use. Defaults to 3.
+            demonstration_selection (str): How demonstrations are selected from the retrieved candidates. Defaults to "similarity".
+                - "similarity": The most similar records.
+                - "mmr": Maximal marginal relevance, trading off similarity against redundancy among the demonstrations.
+                - "label_balanced": The most similar records per label, with the labels ("output") as evenly represented as possible.
+            fetch_k (int): The number of candidates retrieved per input for "mmr" and "label_balanced". Defaults to 4 * number_demonstrations.
+            mmr_lambda (float): Trade-off between similarity (1.0) and diversity (0.0) for "mmr". Defaults to 0.5.
+            retrieval_batch_size (int): The number of inputs whose demonstrations are retrieved and selected at once. Defaults to 32.
+            stop_condition (Callable[[str], bool]): Streams the output and stops generating once the condition is met for the text generated so far,
+                                                    e.g. evaluation.stop_on_first_int("Valid:"). Defaults to None (full generation).
+                                                    The task description must instruct the model to emit the marker before the label,
+                                                    as the demonstrations only contain the (reasoning and) output.
 
         Returns:
             list[str]: A list of predicted outputs based on the provided input or validation split.
@@ -189,36 +207,67 @@ class AnnotationProject:
         raise TypeError("Invalid input type. Expected None, list, or str.")
 
 
-    def _retrieve_k_similar(self, text: str, k: int) -> list[dict]:
+    def _retrieve_demonstrations(self, texts: list[str], **kwargs) -> list[list[dict]]:
         """
-        Retrieves the top k most similar records from the database.
-        The returned list is ordered by similarity - beginning with the most similar
+        Retrieves the demonstrations for a batch of texts from the database.
+        Each returned list is ordered like ChromaDB.query - the most relevant record last.
 
         Args:
-            text: The text for which similar records are to be retrieved.
-            k: The number of similar records to retrieve.
+            texts: The texts for which demonstrations are to be retrieved.
+
+        Kwargs:
+            number_demonstrations, demonstration_selection, fetch_k, mmr_lambda: See predict.
         """
-        
+
+        k: int = kwargs.get("number_demonstrations", 3)
+        selection: str = kwargs.get("demonstration_selection", "similarity")
+
         if k == 0:
-           return []
+            return [[] for _ in texts]
         if k < 0:
             logging.warning("The value of k is negative. No demonstrations will be retrieved.")
-            return []
-        
-        return self.db.query(text, k)
-    
+            return [[] for _ in texts]
+        if selection not in {"similarity", "mmr", "label_balanced"}:
+            raise ValueError("Invalid demonstration_selection. Expected 'similarity', 'mmr' or 'label_balanced'.")
+
+        if selection == "similarity":
+            batch_records, _ = self.db.query_batch(texts, k)
+            return [records[::-1] for records in batch_records]
+
+        # over-fetch candidates and select k of them
+        fetch_k: int = kwargs.get("fetch_k", 4 * k)
+        if fetch_k < k:
+            raise ValueError("fetch_k must be at least number_demonstrations.")
+        batch_records, query_embeddings = self.db.query_batch(texts, fetch_k, include_embeddings = selection == "mmr")
+
+        if selection == "mmr":
+            # pad to a common number of candidates so the whole batch is selected at once
+            n_candidates: int = max(len(records) for records in batch_records)
+            if n_candidates == 0:
+                return [[] for _ in texts]
+            dim: int = len(query_embeddings[0])
+            candidate_embeddings = numpy.zeros((len(texts), n_candidates, dim), dtype=numpy.float32)
+            mask = numpy.zeros((len(texts), n_candidates), dtype=bool)
+            for i, records in enumerate(batch_records):
+                for j, record in enumerate(records):
+                    candidate_embeddings[i, j] = record.pop("embedding")
+                    mask[i, j] = True
+            selections = mmr_select(query_embeddings, candidate_embeddings, k, kwargs.get("mmr_lambda", 0.5), mask)
+        else:
+            selections = label_balanced_select([[record.get("output") for record in records] for records in batch_records], k)
 
-    def _predict_single_case(self, input_data: str, **kwargs) -> list[str]:
+        return [[records[idx] for idx in selected][::-1] for records, selected in zip(batch_records, selections)]
+
+
+    def _build_conversation(self, input_data: str, demonstrations: list[dict], **kwargs) -> list[dict]:
         """
-        Predicts a single case
-        
+        Builds the synthetic conversation from the demonstrations and the input to annotate.
+
         kwargs:
-            number_demonstrations: The number of similar records to retrieve to pass to the model as synthetic conversation.
             use_reasoning (bool): Whether the model should use the generated reasonings
         """
-        
+
         conversation: list[dict] = []
-        demonstrations: list[dict] = self._retrieve_k_similar(input_data, kwargs.get("number_demonstrations", 3))
 
         for record in demonstrations:
             # user
@@ -239,7 +288,31 @@ class AnnotationProject:
         user_request += input_data
         conversation.append({"role": "user", "content": user_request})
 
-        return [self.config.annotation_model.generate(conversation)]
+        return conversation
+
+
+    def _generate(self, conversation: list[dict], **kwargs) -> str:
+        """
+        Generates the annotation for a conversation, stopping early if a stop_condition is given.
+        """
+
+        if kwargs.get("stop_condition", None):
+            return self.config.annotation_model.generate_until(conversation, kwargs["stop_condition"])
+        return self.config.annotation_model.generate(conversation)
+    
+
+    def _predict_single_case(self, input_data: str, **kwargs) -> list[str]:
+        """
+        Predicts a single case
+        
+        kwargs:
+            number_demonstrations: The number of similar records to retrieve to pass to the model as synthetic conversation.
+            use_reasoning (bool): Whether the model should use the generated reasonings
+            stop_condition (Callable[[str], bool]): If given, generation stops as soon as the condition is met
+        """
+        
+        demonstrations: list[dict] = self._retrieve_demonstrations([input_data], **kwargs)[0]
+        return [self._generate(self._build_conversation(input_data, demonstrations, **kwargs), **kwargs)]
         
 
     def _predict_list(self, input_data: list[str], **kwargs) -> list[str]:
@@ -250,13 +323,18 @@ class AnnotationProject:
             **kwargs: Additional keyword arguments to be passed to the prediction function.
 
         Notes:
-            - Uses the _predict_single_case method until a batch prediction method is implemented.
+            - Demonstrations are retrieved and selected in batches of retrieval_batch_size; generation still runs case by case.
         """
 
         annotated_cases: list[str] = []
-
-        for record in tqdm.tqdm(input_data):
-            annotated_cases.extend(self._predict_single_case(record, **kwargs))
+        batch_size: int = kwargs.get("retrieval_batch_size", 32)
+
+        with tqdm.tqdm(total=len(input_data)) as progress:
+            for start in range(0, len(input_data), batch_size):
+                batch: list[str] = input_data[start:start + batch_size]
+                for record, demonstrations in zip(batch, self._retrieve_demonstrations(batch, **kwargs)):
+                    annotated_cases.append(self._generate(self._build_conversation(record, demonstrations, **kwargs), **kwargs))
+                    progress.update(1)
 
         return annotated_cases
     
@@ -1,15 +1,19 @@
 import chromadb
+from chromadb.utils import embedding_functions
 from .config import AnnotationConfig
 import logging
+import hashlib
+import json
 import abc
 
 
 class DB(abc.ABC):
 
     @abc.abstractmethod
-    def insert_data(self, path: str):
+    def insert_data(self, records: list[dict]) -> dict:
         """
         Takes data as a list of dicts which contain this projects standard keys (input, output, id, reasoning, split) and inputs them in the databases native way.
+        Returns a report with the number of "added", "updated", "skipped", "conflicts" and "migrated" records.
         """
         pass
 
@@ -29,36 +33,165 @@ class ChromaDB(DB):
         
         if not config.embedding_model:
             self.collection = self.client.get_or_create_collection(config.collection_name)
+            self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
             logging.warning("No embedding_model passed. Defaulting to ChromaDB's default model: 'all-MiniLM-L6-v2'")
         else:
             self.collection = self.client.get_or_create_collection(config.collection_name,  embedding_function=config.embedding_model)
+            self.embedding_function = config.embedding_model
 
 
-    def insert_data(self, records: list[dict]) -> None:
+    def insert_data(self, records: list[dict]) -> dict:
         """
-        Inserts a list of data records into the database collection.
+        Incrementally inserts a list of data records into the database collection.
+        Only new records and records with a changed input are embedded; records with changed metadata only are updated without embedding, unchanged records are skipped.
         
         Args:
             data: A list of dictionaries where each dictionary represents a data record.
+
+        Returns:
+            A report with the number of "added", "updated", "skipped" (unchanged), "conflicts" and "migrated" records.
         
         Notes:
             - The "input" key in each dictionary is used as the document content and is automatically tokenized and vectorized.
-            - If the "id" key is not provided in the dictionaries, a warning is logged and the index of the record is used as the ID.
+            - If the "id" key is not provided in the dictionaries, a stable ID is derived from the hash of the "input".
+            - A hash of the imported content is stored as "content_hash" in the metadata to detect changed records on later imports.
+              Metadata keys of a changed record that are missing from the new record (e.g. a stale "reasoning") are cleared.
+            - Records sharing an ID within the same import are conflicts if their content differs: only the first one is inserted and a warning is logged.
+            - Records imported without IDs by earlier versions (index IDs "id{i}", no "content_hash") are moved to their content hash ID
+              when their input is imported again, reusing the stored embedding.
         """
 
-        documents: list[str] = [record.pop("input") for record in records]
+        id_available: bool = bool(records[0].get("id", None))
+        if not id_available:
+            logging.info("No IDs inserted. Using the content hash of the input as ID")
 
-        if records[0].get("id", None):
-            ids: list = [record.pop("id") for record in records]
-        else:
-            ids: list = [f"id{i}" for i in range(len(records))]
-            logging.warning("No IDs inserted. Using the index as ID")
+        # deduplicate and hash the imported content
+        new_records: dict = {}
+        skipped: int = 0
+        conflicts: list[str] = []
+        for record in records:
+            record_id: str = str(record.pop("id")) if id_available else self._hash(record["input"])
+            record["content_hash"] = self._content_hash(record)
+            if record_id not in new_records:
+                new_records[record_id] = record
+            elif new_records[record_id]["content_hash"] == record["content_hash"]:
+                skipped += 1
+            else:
+                kept: dict = new_records[record_id]
+                conflicts.append(f"{record_id} (kept output={kept.get('output')!r}, split={kept.get('split')!r}; dropped output={record.get('output')!r}, split={record.get('split')!r})")
 
-        self.collection.add(
-            documents = documents,
-            metadatas = records,
-            ids = ids
-        )
+        if conflicts:
+            logging.warning(f"{len(conflicts)} records share their ID with a different record in the same import and were not inserted: " + "; ".join(conflicts))
+
+        # diff against the stored records
+        existing = self.collection.get(ids=list(new_records.keys()), include=["documents", "metadatas"])
+        stored: dict = {record_id: (document, metadata or {}) for record_id, document, metadata in zip(existing["ids"], existing["documents"], existing["metadatas"])}
+        migrated: int = 0 if id_available else self._migrate_legacy_records(new_records, stored, len(records))
+
+        added: list[str] = [record_id for record_id in new_records if record_id not in stored]
+        updated: list[str] = [record_id for record_id in new_records if record_id in stored and self._stored_hash(new_records[record_id], *stored[record_id]) != new_records[record_id]["content_hash"]]
+        skipped += len(new_records) - len(added) - len(updated)
+
+        # metadata keys of changed records that are missing from the new record are cleared, as chroma merges metadata on update
+        metadatas: dict = {record_id: {key: value for key, value in record.items() if key != "input"} for record_id, record in new_records.items()}
+        for record_id in updated:
+            metadatas[record_id].update({key: None for key in stored[record_id][1] if key not in metadatas[record_id]})
+
+        if added:
+            self.collection.add(
+                documents = [new_records[record_id]["input"] for record_id in added],
+                metadatas = [metadatas[record_id] for record_id in added],
+                ids = added
+            )
+
+        # only re-embed records whose input changed
+        updated_documents: list[str] = [record_id for record_id in updated if stored[record_id][0] != new_records[record_id]["input"]]
+        updated_metadatas: list[str] = [record_id for record_id in updated if stored[record_id][0] == new_records[record_id]["input"]]
+        if updated_documents:
+            self.collection.upsert(
+                documents = [new_records[record_id]["input"] for record_id in updated_documents],
+                metadatas = [metadatas[record_id] for record_id in updated_documents],
+                ids = updated_documents
+            )
+        if updated_metadatas:
+            self.collection.update(
+                metadatas = [metadatas[record_id] for record_id in updated_metadatas],
+                ids = updated_metadatas
+            )
+
+        return {"added": len(added), "updated": len(updated), "skipped": skipped, "conflicts": len(conflicts), "migrated": migrated}
+
+
+    def _migrate_legacy_records(self, new_records: dict, stored: dict, n_records: int) -> int:
+        """
+        Moves records that earlier versions imported without IDs (index IDs "id{i}", no "content_hash") to the content hash ID of the matching new record.
+        The stored embedding is reused, so migrated records are not embedded again. Migrated records are added to stored.
+
+        Returns:
+            The number of migrated records.
+        """
+
+        # earlier versions used the row index of the import as ID, so re-importing the same data covers these IDs
+        legacy = self.collection.get(ids=[f"id{i}" for i in range(n_records)], include=["documents", "metadatas", "embeddings"])
+
+        matches: dict = {}
+        legacy_ids: list[str] = []
+        unmatched: int = 0
+        for legacy_id, document, metadata, embedding in zip(legacy["ids"], legacy["documents"], legacy["metadatas"], legacy["embeddings"]):
+            if (metadata or {}).get("content_hash"):
+                continue
+            record_id: str = self._hash(document)
+            if record_id not in new_records:
+                unmatched += 1
+                continue
+            # duplicated legacy records, or ones already stored under their content hash ID, are merged into the first one
+            if record_id not in stored:
+                matches.setdefault(record_id, (document, metadata, embedding))
+            legacy_ids.append(legacy_id)
+
+        if unmatched:
+            logging.warning(f"{unmatched} records imported by an earlier version without IDs do not match this import and keep their index IDs. Re-import their data to migrate them.")
+        if not legacy_ids:
+            return 0
+
+        if matches:
+            self.collection.add(
+                documents = [document for document, _, _ in matches.values()],
+                metadatas = [metadata for _, metadata, _ in matches.values()],
+                embeddings = [embedding for _, _, embedding in matches.values()],
+                ids = list(matches.keys())
+            )
+        self.collection.delete(ids=legacy_ids)
+        for record_id, (document, metadata, _) in matches.items():
+            stored[record_id] = (document, metadata)
+
+        logging.info(f"Migrated {len(legacy_ids)} records imported by an earlier version to content hash IDs.")
+        return len(legacy_ids)
+
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+    @classmethod
+    def _content_hash(cls, record: dict) -> str:
+        """
+        Returns a stable hash of a record's content, independent of key order.
+        """
+        content: dict = {key: value for key, value in record.items() if key != "content_hash"}
+        # numpy scalars (e.g. from pandas) are hashed like their python equivalents
+        return cls._hash(json.dumps(content, sort_keys=True, default=lambda value: value.item() if hasattr(value, "item") else str(value)))
+
+
+    @classmethod
+    def _stored_hash(cls, record: dict, document: str, metadata: dict) -> str:
+        """
+        Returns the content hash of a stored record. Records stored without "content_hash" by earlier versions are hashed on the keys of the new record.
+        """
+        if metadata.get("content_hash"):
+            return metadata["content_hash"]
+        return cls._content_hash({key: document if key == "input" else metadata.get(key) for key in record})
     
 
     def full_extraction(self, include_embeddings: bool = False) -> list[dict]:
@@ -119,15 +252,38 @@ class ChromaDB(DB):
             k: Amount of similar cases
             split: Split to query
         """
+        batch_records, _ = self.query_batch([text], k=k, split=split)
+        records: list[dict] = batch_records[0]
+        return records[::-1] # most similar first last so it has the most influence on the final decision (i hope)
+
+
+    def query_batch(self, texts: list[str], k = 3, split = "train", include_embeddings: bool = False) -> tuple[list[list[dict]], list]:
+        """
+        Queries the DB for k similar entries for each text in a single request.
+
+        Args:
+            texts: Strings that should be comparable to the entries in the db
+            k: Amount of similar cases per text
+            split: Split to query
+            include_embeddings: Whether to add the "embedding" of each entry to the records
+
+        Returns:
+            A list of records per text (most similar first) and the embeddings of the texts.
+        """
+        query_embeddings = self.embedding_function(texts)
         query_results = self.collection.query(
-                query_texts=[text],
+                query_embeddings=query_embeddings,
                 n_results=k,
                 where={"split": split},
+                include=["documents", "metadatas", "embeddings"] if include_embeddings else ["documents", "metadatas"]
             )
-        
-        # restructure to fit the projects general structure -> most similar doc first
-        records: list[dict] = query_results["metadatas"][0]
-        
-        for i, example in enumerate(records):
-            example["input"] = query_results["documents"][0][i]
-        return records[::-1] # most similar first last so it has the most influence on the final decision (i hope)
\ No newline at end of file
+
+        # restructure to fit the projects general structure
+        batch_records: list[list[dict]] = []
+        for q, records in enumerate(query_results["metadatas"]):
+            for i, example in enumerate(records):
+                example["input"] = query_results["documents"][q][i]
+                if include_embeddings:
+                    example["embedding"] = query_results["embeddings"][q][i]
+            batch_records.append(records)
+        return batch_records, query_embeddings
\ No newline at end of file
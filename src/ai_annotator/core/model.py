@@ -3,6 +3,8 @@ from openai import OpenAI
 import pydantic
 import ollama
 import importlib
+import threading
+from typing import Callable, Iterator
 
 class Model(abc.ABC):
 
@@ -12,6 +14,32 @@ class Model(abc.ABC):
         Takes the commonly used input format ([{"role": "user", "content": "xyz"}) and returns only the generated output
         """
 
+    def stream(self, conv: list[dict]) -> Iterator[str]:
+        """
+        Yields the generated output in chunks. Models without native streaming yield the full output as a single chunk.
+        Closing the iterator early should abort the generation.
+        """
+        yield self.generate(conv)
+
+    def generate_until(self, conv: list[dict], stop_condition: Callable[[str], bool]) -> str:
+        """
+        Streams the output and stops as soon as stop_condition returns True for the text generated so far.
+
+        Args:
+            conv: Conversation in the commonly used input format.
+            stop_condition: Callable that receives the accumulated output, e.g. evaluation.parser.stop_on_first_int("Valid:").
+        """
+        text: str = ""
+        chunks: Iterator[str] = self.stream(conv)
+        try:
+            for chunk in chunks:
+                text += chunk
+                if stop_condition(text):
+                    break
+        finally:
+            chunks.close()
+        return text
+
 
 class OllamaModel(Model):
     
@@ -24,6 +52,15 @@ class OllamaModel(Model):
         response: str = self.client.chat(model=self.model, messages=conv)
         return response["message"]["content"]
 
+    def stream(self, conv: list[dict]) -> Iterator[str]:
+        response = self.client.chat(model=self.model, messages=conv, stream=True)
+        try:
+            for chunk in response:
+                yield chunk["message"]["content"]
+        finally:
+            # closes the http stream so the server stops generating
+            response.close()
+
 
 class OpenAIModel(Model):
 
@@ -38,6 +75,20 @@ class OpenAIModel(Model):
             )
         return response.choices[0].message.content
 
+    def stream(self, conv: list[dict]) -> Iterator[str]:
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=conv,
+            stream=True
+            )
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # closes the http connection so the server stops generating
+            response.close()
+
     def generate_structured_response(self, conv: list[dict], structure: pydantic.BaseModel):
         response = self.client.beta.chat.completions.parse(
             model = self.model,
@@ -53,6 +104,7 @@ class HuggingFaceModel(Model):
 
         # import
         transformers = importlib.import_module("transformers")
+        self.transformers = transformers
         self.torch = importlib.import_module("torch")
 
         # run init
@@ -67,3 +119,36 @@ class HuggingFaceModel(Model):
             generated_ids = self.model.generate(conv, temperature = 0.7, do_sample=True, max_new_tokens = 3000)[0][conv.shape[-1]:]
 
         return self.tokenizer.decode(generated_ids, skip_special_tokens=True)
+
+    def stream(self, conv: list[dict]) -> Iterator[str]:
+
+        conv = self.tokenizer.apply_chat_template(conv,  tokenize=True, return_tensors="pt", add_generation_prompt=True).to('cuda')
+        streamer = self.transformers.TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+        # generation runs in a separate thread; the event lets the consumer abort it early
+        stop_event = threading.Event()
+        stopping_criteria = self.transformers.StoppingCriteriaList([lambda input_ids, scores, **kwargs: stop_event.is_set()])
+
+        # exceptions are re-raised in the consumer; ending the streamer keeps the consumer from blocking forever
+        errors: list[BaseException] = []
+
+        def _generate():
+            try:
+                with self.torch.no_grad():
+                    self.model.generate(conv, temperature = 0.7, do_sample=True, max_new_tokens = 3000, streamer=streamer, stopping_criteria=stopping_criteria)
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                streamer.end()
+
+        thread = threading.Thread(target=_generate)
+        thread.start()
+        try:
+            for chunk in streamer:
+                yield chunk
+        finally:
+            stop_event.set()
+            thread.join()
+
+        if errors:
+            raise errors[0]
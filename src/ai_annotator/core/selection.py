@@ -0,0 +1,78 @@
+import numpy
+
+
+def _normalize(embeddings: numpy.ndarray) -> numpy.ndarray:
+    norms = numpy.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / numpy.where(norms == 0, 1, norms)
+
+
+def mmr_select(query_embeddings, candidate_embeddings, k: int, lambda_mult: float = 0.5, mask = None) -> list[list[int]]:
+    """
+    Selects k candidates per query using maximal marginal relevance (MMR), computed for the whole batch at once.
+
+    Args:
+        query_embeddings: Array of shape (batch, dim).
+        candidate_embeddings: Array of shape (batch, candidates, dim).
+        k: Number of candidates to select per query.
+        lambda_mult: Trade-off between relevance (1.0) and diversity (0.0).
+        mask: Optional boolean array of shape (batch, candidates) marking valid candidates.
+
+    Returns:
+        A list of candidate indices per query, in selection order (most relevant first).
+    """
+
+    queries = _normalize(numpy.asarray(query_embeddings, dtype=numpy.float32))
+    candidates = _normalize(numpy.asarray(candidate_embeddings, dtype=numpy.float32))
+    batch_size, n_candidates, _ = candidates.shape
+    available = numpy.ones((batch_size, n_candidates), dtype=bool) if mask is None else numpy.asarray(mask, dtype=bool).copy()
+    n_valid = available.sum(axis=1)
+    k = min(k, n_candidates)
+
+    # cosine similarities: query-candidate (batch, n) and candidate-candidate (batch, n, n)
+    relevance = numpy.einsum("bd,bnd->bn", queries, candidates)
+    similarity = numpy.einsum("bnd,bmd->bnm", candidates, candidates)
+
+    rows = numpy.arange(batch_size)
+    redundancy = numpy.zeros((batch_size, n_candidates), dtype=numpy.float32)
+    selected = numpy.zeros((batch_size, k), dtype=int)
+
+    for step in range(k):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        picks = numpy.where(available, scores, -numpy.inf).argmax(axis=1)
+        selected[:, step] = picks
+        available[rows, picks] = False
+        step_similarity = similarity[rows, :, picks]
+        redundancy = step_similarity if step == 0 else numpy.maximum(redundancy, step_similarity)
+
+    return [selected[i, :min(k, n_valid[i])].tolist() for i in range(batch_size)]
+
+
+def label_balanced_select(candidate_labels: list[list], k: int) -> list[list[int]]:
+    """
+    Selects k candidates per query so that the labels are as evenly represented as possible.
+    Candidates are expected to be ordered by relevance; within each label the most relevant ones are taken first.
+
+    Args:
+        candidate_labels: The label (e.g. "output") of each candidate, per query.
+        k: Number of candidates to select per query.
+
+    Returns:
+        A list of candidate indices per query, in selection order (most relevant first).
+    """
+
+    selections: list[list[int]] = []
+    for labels in candidate_labels:
+        # group candidate indices by label, labels ordered by their most relevant candidate
+        groups: dict = {}
+        for idx, label in enumerate(labels):
+            groups.setdefault(label, []).append(idx)
+
+        selected: list[int] = []
+        depth = 0
+        while len(selected) < min(k, len(labels)):
+            # round-robin over labels, within a round ordered by relevance
+            selected.extend(sorted(group[depth] for group in groups.values() if len(group) > depth)[:k - len(selected)])
+            depth += 1
+        selections.append(selected)
+
+    return selections
@@ -1,4 +1,4 @@
-from .parser import parse_first_int, parse_list
+from .parser import parse_first_int, parse_list, stop_on_first_int
 from .metrics import micro_f1_score
 
-__all__ = ["parse_first_int", "parse_list", "micro_f1_score"]
\ No newline at end of file
+__all__ = ["parse_first_int", "parse_list", "stop_on_first_int", "micro_f1_score"]
\ No newline at end of file
@@ -1,5 +1,6 @@
 import re
 import json
+from typing import Callable
 
 def parse_first_int(strings: list[str], bos_split_token: str = None, eos_split_token: str = None, default_value: int = None) -> list[int]:
     """
@@ -23,6 +24,31 @@ def parse_first_int(strings: list[str], bos_split_token: str = None, eos_split_t
             parsed_integers.append(default_value)
 
     return parsed_integers
+
+
+def stop_on_first_int(bos_split_token: str) -> Callable[[str], bool]:
+    """
+    Creates a stop condition for Model.generate_until that is met once parse_first_int can extract a complete integer after the marker.
+
+    Args:
+        bos_split_token: The marker the model emits right before the label, e.g. "Valid:". Only the text after its last occurrence is considered,
+                         so integers in the reasoning (e.g. "Step 1.") do not stop the generation. The task description must instruct the model to emit it.
+
+    Notes:
+        - The integer counts as complete once it is followed by another character, so a streamed "1" is not mistaken for the start of "10".
+    """
+
+    if not bos_split_token:
+        raise ValueError("A bos_split_token marker is required, e.g. 'Valid:'.")
+
+    def stop_condition(text: str) -> bool:
+        if bos_split_token not in text:
+            return False
+        text = text.split(bos_split_token)[-1]
+        match = re.search(r'\d+', text)
+        return match is not None and match.end() < len(text)
+
+    return stop_condition
     
 
 def parse_list(strings: list[str], bos_split_token: str = None, eos_split_token: str = None, delimiter: str = ",", default_value: list[str] = []) -> list[list[str]]: